@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 """
 Command Line Mashup Creator
-Usage: python <rollnumber>.py <SingerName> <NumberOfVideos> <AudioDuration> <OutputFileName>
+Usage: python <rollnumber>.py <SingerName> <NumberOfVideos> <AudioDuration> <OutputFileName> [--profile] [--formats mp3,opus,...]
 Example: python 1015579.py "Sharry Maan" 20 20 1015579-output.mp3
 """
 
 import sys
 import os
-from mashup_processor import MashupProcessor
+from mashup_processor import MashupProcessor, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMATS
+from job_profiler import JobProfiler
 import tempfile
 import shutil
 
@@ -20,11 +21,20 @@ def print_banner():
 
 def validate_arguments(args):
     """Validate command line arguments"""
+    profile = '--profile' in args[1:]
+    args = [arg for arg in args if arg != '--profile']
+    
+    output_formats = DEFAULT_OUTPUT_FORMATS
+    if '--formats' in args[1:-1]:
+        index = args.index('--formats')
+        output_formats = list(dict.fromkeys(name.strip() for name in args[index + 1].split(',') if name.strip()))
+        args = args[:index] + args[index + 2:]
+    
     if len(args) != 5:
         print("❌ Error: Incorrect number of parameters")
         print()
         print("Usage:")
-        print("  python <program.py> <SingerName> <NumberOfVideos> <AudioDuration> <OutputFileName>")
+        print("  python <program.py> <SingerName> <NumberOfVideos> <AudioDuration> <OutputFileName> [--profile] [--formats mp3,opus,...]")
         print()
         print("Example:")
         print('  python 1015579.py "Sharry Maan" 20 20 1015579-output.mp3')
@@ -34,6 +44,8 @@ def validate_arguments(args):
         print("  NumberOfVideos  : Number of videos to download (must be > 10)")
         print("  AudioDuration   : Duration in seconds for each clip (must be > 20)")
         print("  OutputFileName  : Name of the output file (e.g., output.mp3)")
+        print("  --profile       : Optional, write a collapsed-stack profile next to the output")
+        print(f"  --formats       : Optional, comma-separated output formats ({', '.join(OUTPUT_FORMATS)}; default mp3)")
         print()
         return False
     
@@ -60,11 +72,18 @@ def validate_arguments(args):
             print("❌ Error: Output file must have .mp3 extension")
             return False
         
+        unknown_formats = [name for name in output_formats if name not in OUTPUT_FORMATS]
+        if not output_formats or unknown_formats:
+            print(f"❌ Error: Unknown formats {', '.join(unknown_formats)} (available: {', '.join(OUTPUT_FORMATS)})")
+            return False
+        
         return {
             'singer_name': singer_name,
             'num_videos': num_videos,
             'duration': duration,
-            'output_file': output_file
+            'output_file': output_file,
+            'profile': profile,
+            'output_formats': output_formats
         }
         
     except ValueError as e:
@@ -79,6 +98,20 @@ def progress_callback(message):
     """Display progress messages"""
     print(f"  {message}")
 
+def print_profile_summary(summary):
+    """Display profiling results"""
+    print()
+    if summary['profile_file']:
+        print(f"⏱️  Profile written: {summary['profile_file']}")
+    else:
+        print(f"⚠️  Profile not written: {summary['profile_error']}")
+    print(f"   Wall time        : {summary['wall_seconds']:.2f}s")
+    print(f"   Python CPU time  : {summary['python_cpu_seconds']:.2f}s")
+    print(f"   Subprocess wait  : {summary['subprocess_wait_seconds']:.2f}s")
+    for command, seconds in summary['subprocess_wait_by_command'].items():
+        print(f"     {command:<15}: {seconds:.2f}s")
+    print(f"   Other wait (I/O) : {summary['other_wait_seconds']:.2f}s")
+
 def main():
     """Main function"""
     print_banner()
@@ -92,6 +125,9 @@ def main():
     print(f"Videos         : {params['num_videos']}")
     print(f"Duration       : {params['duration']} seconds")
     print(f"Output File    : {params['output_file']}")
+    print(f"Formats        : {', '.join(params['output_formats'])}")
+    if params['profile']:
+        print("Profiling      : enabled")
     print()
     print("Starting mashup creation...")
     print("-" * 70)
@@ -104,24 +140,42 @@ def main():
         # Initialize processor
         processor = MashupProcessor(temp_dir)
         
-        # Create mashup
-        output_path = processor.create_mashup(
-            singer_name=params['singer_name'],
-            num_videos=params['num_videos'],
-            duration=params['duration'],
-            output_filename=params['output_file'],
-            progress_callback=progress_callback,
-            use_intelligent_extraction=True  # Use intelligent extraction by default
-        )
+        def run_mashup():
+            return processor.create_mashup(
+                singer_name=params['singer_name'],
+                num_videos=params['num_videos'],
+                duration=params['duration'],
+                output_filename=params['output_file'],
+                progress_callback=progress_callback,
+                use_intelligent_extraction=True,  # Use intelligent extraction by default
+                output_formats=params['output_formats']
+            )
+        
+        # Create mashup (optionally under the profiler)
+        if params['profile']:
+            profile_path = os.path.join(os.getcwd(), f"{os.path.splitext(params['output_file'])[0]}.profile.folded")
+            profiler = JobProfiler(profile_path)
+            try:
+                with profiler:
+                    output_paths = run_mashup()
+            finally:
+                if profiler.summary is not None:
+                    print_profile_summary(profiler.summary)
+        else:
+            output_paths = run_mashup()
         
-        # Move output file to current directory
-        final_output = os.path.join(os.getcwd(), params['output_file'])
-        shutil.move(output_path, final_output)
+        # Move output files to current directory
+        final_outputs = []
+        for output_path in output_paths:
+            final_output = os.path.join(os.getcwd(), os.path.basename(output_path))
+            shutil.move(output_path, final_output)
+            final_outputs.append(final_output)
         
         print()
         print("-" * 70)
-        print(f"✅ SUCCESS! Mashup created: {final_output}")
-        print(f"📊 File size: {os.path.getsize(final_output) / (1024*1024):.2f} MB")
+        for final_output in final_outputs:
+            print(f"✅ SUCCESS! Mashup created: {final_output}")
+            print(f"📊 File size: {os.path.getsize(final_output) / (1024*1024):.2f} MB")
         print("=" * 70)
         
     except Exception as e:
@@ -12,10 +12,18 @@ from email.mime.text import MIMEText
 from email import encoders
 import zipfile
 import shutil
+import json
+import time
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process job locks (single-process dev server)
+    fcntl = None
+
 # Import mashup processing
-from mashup_processor import MashupProcessor
+from mashup_processor import MashupProcessor, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMATS
+from job_profiler import JobProfiler
 
 app = Flask(__name__)
 CORS(app)
@@ -29,6 +37,20 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 # In-memory job tracking
 jobs = {}
 
+# Request parameters saved in each job folder so the job can be retried or recovered
+JOB_REQUEST_FILE = 'job.json'
+
+# Lock file held by the process running a job, so workers never run the same job twice
+JOB_LOCK_FILE = 'job.lock'
+
+# Failed job folders (downloads, segments, checkpoint) are deleted after this long
+FAILED_JOB_RETENTION_SECONDS = 24 * 60 * 60
+
+# Jobs with a running thread in this process
+running_jobs = set()
+jobs_lock = threading.Lock()
+jobs_recovered = False
+
 class EmailConfig:
     """Email configuration - UPDATE THESE WITH YOUR CREDENTIALS"""
     SMTP_SERVER = "smtp.gmail.com"
@@ -69,41 +91,175 @@ def send_email_with_attachment(recipient_email, subject, body, attachment_path,
         jobs[job_id]['message'] = f'Email error: {str(e)}'
         return False
 
-def process_mashup_task(job_id, singer_name, num_videos, duration, email, use_intelligent_extraction):
+def save_job_request(job_id, **updates):
+    """Create or update the saved request of a job"""
+    job_folder = os.path.join(UPLOAD_FOLDER, job_id)
+    os.makedirs(job_folder, exist_ok=True)
+    request_data = load_job_request(job_id) or {}
+    request_data.update(updates)
+    
+    path = os.path.join(job_folder, JOB_REQUEST_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(request_data, f)
+    os.replace(path + '.tmp', path)
+
+def load_job_request(job_id):
+    """Load the saved request of a job, or None if there is none"""
+    try:
+        with open(os.path.join(UPLOAD_FOLDER, job_id, JOB_REQUEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def claim_job(job_id):
+    """Lock a job folder for this process
+    
+    Returns the open lock file (closing it releases the claim), or None if the
+    job is already claimed by another worker or its folder is gone.
+    """
+    try:
+        lock_file = open(os.path.join(UPLOAD_FOLDER, job_id, JOB_LOCK_FILE), 'a')
+    except OSError:
+        return None
+    
+    if fcntl:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    
+    return lock_file
+
+def reserve_job(job_id):
+    """Mark a job as running in this process; call with jobs_lock held
+    
+    Returns the claimed lock file, or None if the job is already running,
+    in this process or another worker.
+    """
+    if job_id in running_jobs:
+        return None
+    lock_file = claim_job(job_id)
+    if lock_file is None:
+        return None
+    running_jobs.add(job_id)
+    return lock_file
+
+def start_job(job_id, request_data):
+    """Start background processing of a saved job request
+    
+    Returns False if the job is already running, in this process or another worker.
+    """
+    with jobs_lock:
+        lock_file = reserve_job(job_id)
+    if lock_file is None:
+        return False
+    
+    launch_job(job_id, request_data, lock_file)
+    return True
+
+def launch_job(job_id, request_data, lock_file):
+    """Run a reserved job in a background thread, releasing it when done"""
+    def run():
+        try:
+            process_mashup_task(
+                job_id, request_data['singer_name'], request_data['num_videos'], request_data['duration'],
+                request_data['email'], request_data['use_intelligent_extraction'],
+                request_data.get('profile', False), request_data.get('output_formats')
+            )
+        finally:
+            with jobs_lock:
+                running_jobs.discard(job_id)
+                lock_file.close()
+    
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+def cleanup_failed_jobs():
+    """Delete failed job folders older than FAILED_JOB_RETENTION_SECONDS"""
+    cutoff = time.time() - FAILED_JOB_RETENTION_SECONDS
+    for job_id in os.listdir(UPLOAD_FOLDER):
+        request_data = load_job_request(job_id)
+        if not request_data or request_data.get('status') != 'failed':
+            continue
+        
+        try:
+            if os.path.getmtime(os.path.join(UPLOAD_FOLDER, job_id, JOB_REQUEST_FILE)) > cutoff:
+                continue
+        except OSError:
+            continue
+        
+        # Skip jobs being retried right now
+        with jobs_lock:
+            if job_id in running_jobs:
+                continue
+            lock_file = claim_job(job_id)
+            if lock_file is None:
+                continue
+            shutil.rmtree(os.path.join(UPLOAD_FOLDER, job_id), ignore_errors=True)
+            lock_file.close()
+        
+        if job_id in jobs:
+            jobs[job_id]['message'] += ' (job data expired)'
+
+def process_mashup_task(job_id, singer_name, num_videos, duration, email, use_intelligent_extraction,
+                        profile=False, output_formats=None):
     """Background task to process mashup"""
     try:
         jobs[job_id]['status'] = 'processing'
         jobs[job_id]['message'] = 'Downloading videos...'
+        save_job_request(job_id, status='processing')
         
         # Create job folder
         job_folder = os.path.join(UPLOAD_FOLDER, job_id)
         os.makedirs(job_folder, exist_ok=True)
         
-        # Initialize processor
+        # Initialize processor (resumes from the job folder's checkpoint, if any)
         processor = MashupProcessor(job_folder)
+        jobs[job_id]['reused'] = processor.checkpoint.reused
+        
+        # Profile output is kept in OUTPUT_FOLDER so it survives job folder cleanup
+        profiler = None
+        if profile:
+            profiler = JobProfiler(os.path.join(OUTPUT_FOLDER, f"{job_id}_profile.folded"))
         
         # Update progress callback
         def update_progress(message):
             jobs[job_id]['message'] = message
         
-        # Process mashup
-        output_file = processor.create_mashup(
-            singer_name=singer_name,
-            num_videos=num_videos,
-            duration=duration,
-            output_filename=f"{job_id}_mashup.mp3",
-            progress_callback=update_progress,
-            use_intelligent_extraction=use_intelligent_extraction
-        )
+        def run_mashup():
+            return processor.create_mashup(
+                singer_name=singer_name,
+                num_videos=num_videos,
+                duration=duration,
+                output_filename=f"{job_id}_mashup.mp3",
+                progress_callback=update_progress,
+                use_intelligent_extraction=use_intelligent_extraction,
+                output_formats=output_formats
+            )
         
-        if not output_file or not os.path.exists(output_file):
+        # Process mashup (optionally under the profiler)
+        if profiler:
+            try:
+                with profiler:
+                    output_files = run_mashup()
+            finally:
+                jobs[job_id]['profile'] = profiler.summary
+                # Persist with the job so the profile survives a restart
+                save_job_request(job_id, profile_summary=profiler.summary)
+        else:
+            output_files = run_mashup()
+        
+        if not output_files or not all(os.path.exists(path) for path in output_files):
             raise Exception("Failed to create mashup")
         
         # Create ZIP file
         jobs[job_id]['message'] = 'Creating ZIP file...'
         zip_path = os.path.join(OUTPUT_FOLDER, f"{job_id}_mashup.zip")
         with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.write(output_file, os.path.basename(output_file))
+            for output_file in output_files:
+                zipf.write(output_file, os.path.basename(output_file))
         
         # Send email
         jobs[job_id]['message'] = 'Sending email...'
@@ -125,6 +281,7 @@ def process_mashup_task(job_id, singer_name, num_videos, duration, email, use_in
                         <li>📹 Videos processed: {num_videos}</li>
                         <li>⏱️ Duration per clip: {duration} seconds</li>
                         <li>🎼 Processing: {"Intelligent Chorus Extraction" if use_intelligent_extraction else "Standard Extraction"}</li>
+                        <li>💾 Formats: {", ".join(output_formats or DEFAULT_OUTPUT_FORMATS)}</li>
                     </ul>
                 </div>
                 <p style="color: #333; font-size: 16px; line-height: 1.6;">
@@ -138,7 +295,7 @@ def process_mashup_task(job_id, singer_name, num_videos, duration, email, use_in
         </html>
         """
         
-        send_email_with_attachment(
+        sent = send_email_with_attachment(
             recipient_email=email,
             subject=f"🎵 Your {singer_name} Mashup is Ready!",
             body=email_body,
@@ -146,6 +303,14 @@ def process_mashup_task(job_id, singer_name, num_videos, duration, email, use_in
             job_id=job_id
         )
         
+        if not sent:
+            # Keep the job folder so a retry reuses the merged mashup
+            save_job_request(job_id, status='failed')
+            return
+        
+        # Never resend if cleanup below is interrupted
+        save_job_request(job_id, status='completed')
+        
         # Cleanup
         shutil.rmtree(job_folder, ignore_errors=True)
         
@@ -153,6 +318,8 @@ def process_mashup_task(job_id, singer_name, num_videos, duration, email, use_in
         jobs[job_id]['status'] = 'failed'
         jobs[job_id]['message'] = str(e)
         print(f"Error processing job {job_id}: {str(e)}")
+        # Job folder is kept so the job can be retried from its checkpoint
+        save_job_request(job_id, status='failed')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -176,6 +343,8 @@ def create_mashup():
         duration = int(data['duration'])
         email = data['email'].strip()
         use_intelligent = data.get('intelligentExtraction', True)
+        profile = data.get('profile', False)
+        output_formats = data.get('formats', DEFAULT_OUTPUT_FORMATS)
         
         # Validate ranges
         if num_videos < 10:
@@ -188,6 +357,16 @@ def create_mashup():
             return jsonify({'error': 'Duration cannot exceed 60 seconds'}), 400
         if '@' not in email:
             return jsonify({'error': 'Invalid email address'}), 400
+        if not isinstance(profile, bool):
+            return jsonify({'error': 'Profile must be true or false'}), 400
+        if not isinstance(output_formats, list) or not output_formats:
+            return jsonify({'error': 'Formats must be a non-empty list'}), 400
+        unknown_formats = [name for name in output_formats
+                           if not isinstance(name, str) or name not in OUTPUT_FORMATS]
+        if unknown_formats:
+            return jsonify({'error': f"Unknown formats: {', '.join(map(str, unknown_formats))} "
+                                     f"(available: {', '.join(OUTPUT_FORMATS)})"}), 400
+        output_formats = list(dict.fromkeys(output_formats))
         
         # Create job
         job_id = str(uuid.uuid4())
@@ -197,16 +376,28 @@ def create_mashup():
             'created_at': datetime.now().isoformat(),
             'singer': singer_name,
             'num_videos': num_videos,
-            'duration': duration
+            'duration': duration,
+            'profiling': profile,
+            'formats': output_formats
         }
         
-        # Start background processing
-        thread = threading.Thread(
-            target=process_mashup_task,
-            args=(job_id, singer_name, num_videos, duration, email, use_intelligent)
+        # Expire old failed jobs before adding a new one
+        cleanup_failed_jobs()
+        
+        # Save request and start background processing
+        save_job_request(
+            job_id,
+            singer_name=singer_name,
+            num_videos=num_videos,
+            duration=duration,
+            email=email,
+            use_intelligent_extraction=use_intelligent,
+            profile=profile,
+            output_formats=output_formats,
+            created_at=jobs[job_id]['created_at'],
+            status='queued'
         )
-        thread.daemon = True
-        thread.start()
+        start_job(job_id, load_job_request(job_id))
         
         return jsonify({
             'success': True,
@@ -227,6 +418,44 @@ def get_job_status(job_id):
     
     return jsonify(jobs[job_id])
 
+@app.route('/api/retry-job/<job_id>', methods=['POST'])
+def retry_job(job_id):
+    """Retry a failed job, resuming from its last checkpoint"""
+    if job_id not in jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    request_data = load_job_request(job_id)
+    if not request_data:
+        return jsonify({'error': 'Job data no longer available, please create a new mashup'}), 410
+    
+    # Check, claim and update together so concurrent retries start only one
+    # thread and a refused retry leaves the job failed (and retriable)
+    with jobs_lock:
+        if jobs[job_id]['status'] != 'failed':
+            return jsonify({'error': f"Only failed jobs can be retried (job is {jobs[job_id]['status']})"}), 400
+        lock_file = reserve_job(job_id)
+        if lock_file is None:
+            return jsonify({'error': 'Job is still shutting down or running elsewhere, try again shortly'}), 409
+        jobs[job_id]['status'] = 'queued'
+        jobs[job_id]['message'] = 'Retrying from last checkpoint'
+    
+    launch_job(job_id, request_data, lock_file)
+    
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Job restarted'})
+
+@app.route('/api/job-profile/<job_id>', methods=['GET'])
+def get_job_profile(job_id):
+    """Download the collapsed-stack profile of a profiled job"""
+    if job_id not in jobs:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    profile = jobs[job_id].get('profile')
+    if not profile or not profile.get('profile_file') or not os.path.exists(profile['profile_file']):
+        return jsonify({'error': 'No profile available for this job'}), 404
+    
+    return send_file(os.path.abspath(profile['profile_file']), mimetype='text/plain',
+                     as_attachment=True, download_name=os.path.basename(profile['profile_file']))
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """Get service statistics"""
@@ -242,7 +471,57 @@ def get_stats():
         'failed': failed
     })
 
+def recover_jobs():
+    """Resume jobs that were queued or running when the server stopped
+    
+    Called once at server startup (see gunicorn.conf.py and __main__ below).
+    Each job is claimed through its lock file, so with several workers only
+    one of them resumes it.
+    """
+    global jobs_recovered
+    if jobs_recovered:
+        return
+    jobs_recovered = True
+    
+    cleanup_failed_jobs()
+    
+    for job_id in os.listdir(UPLOAD_FOLDER):
+        request_data = load_job_request(job_id)
+        if not request_data or job_id in jobs:
+            continue
+        
+        # Email already sent, only the cleanup was interrupted
+        if request_data['status'] == 'completed':
+            shutil.rmtree(os.path.join(UPLOAD_FOLDER, job_id), ignore_errors=True)
+            continue
+        
+        jobs[job_id] = {
+            'status': request_data['status'] if request_data['status'] == 'failed' else 'queued',
+            'message': 'Recovered after restart',
+            'created_at': request_data['created_at'],
+            'singer': request_data['singer_name'],
+            'num_videos': request_data['num_videos'],
+            'duration': request_data['duration'],
+            'profiling': request_data.get('profile', False),
+            'formats': request_data.get('output_formats') or DEFAULT_OUTPUT_FORMATS
+        }
+        if request_data.get('profile_summary'):
+            jobs[job_id]['profile'] = request_data['profile_summary']
+        
+        # Failed jobs stay failed until retried explicitly
+        if request_data['status'] == 'failed':
+            continue
+        
+        if start_job(job_id, request_data):
+            print(f"Recovering job {job_id}")
+        else:
+            del jobs[job_id]  # Claimed by another worker
+
 if __name__ == '__main__':
+    # Skip the parent process of the debug reloader, which does not serve requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        recover_jobs()
+    
     print("🎵 Mashup Studio API Starting...")
     print("=" * 50)
     print(f"Server running on: http://localhost:5000")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Export Benchmark
+Compares the single-pass encoding ladder (one ffmpeg run, one output per format)
+against exporting each format separately with pydub.
+Usage: python benchmark_export.py [MashupMinutes] [Formats] [Runs]
+Example: python benchmark_export.py 10 mp3,mp3-mobile,opus,aac 3
+"""
+
+import sys
+import os
+import time
+import tempfile
+import shutil
+from pydub.generators import Sine
+from mashup_processor import MashupProcessor, OUTPUT_FORMATS
+
+
+def make_audio(minutes):
+    """Stereo 44.1kHz test signal as long as a typical mashup"""
+    tone = Sine(440, sample_rate=44100).to_audio_segment(duration=1000, volume=-12)
+    return (tone * (minutes * 60)).set_channels(2)
+
+
+def single_pass(processor, audio, outputs):
+    processor.encode_outputs(audio, outputs)
+
+
+def separate_exports(audio, outputs):
+    for path, name in outputs:
+        preset = OUTPUT_FORMATS[name]
+        audio.export(path, format=preset['container'], parameters=preset['codec'])
+
+
+def best_time(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    formats = sys.argv[2].split(',') if len(sys.argv) > 2 else list(OUTPUT_FORMATS)
+    runs = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    temp_dir = tempfile.mkdtemp(prefix='mashup_bench_')
+    try:
+        processor = MashupProcessor(temp_dir)
+        audio = make_audio(minutes)
+        outputs = processor.output_paths(os.path.join(temp_dir, 'bench.mp3'), formats)
+
+        print(f"Audio   : {minutes} min, {audio.frame_rate} Hz, {audio.channels} ch")
+        print(f"Formats : {', '.join(formats)}")
+        print(f"Runs    : {runs} (best time reported)")
+        print("-" * 50)
+
+        separate = best_time(lambda: separate_exports(audio, outputs), runs)
+        single = best_time(lambda: single_pass(processor, audio, outputs), runs)
+
+        print(f"{len(outputs)} separate exports : {separate:.2f}s")
+        print(f"Single-pass ladder  : {single:.2f}s")
+        print(f"Speedup             : {separate / single:.2f}x")
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+# Gunicorn settings, loaded automatically by `gunicorn app:app` from this directory
+
+
+def post_worker_init(worker):
+    """Resume interrupted jobs once the worker has loaded the app"""
+    from app import recover_jobs
+    recover_jobs()
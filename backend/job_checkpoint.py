@@ -0,0 +1,107 @@
+import json
+import os
+
+
+class JobCheckpoint:
+    """Durable record of the completed work units of a mashup job
+
+    Stored as JSON in the job's working directory and rewritten atomically
+    after every unit of work, so a retried or restarted job can resume where
+    it stopped. File paths are kept relative to the working directory.
+
+    Layout:
+        params          : job parameters the checkpoint belongs to
+        search_results  : [{'id', 'webpage_url'}, ...] from the YouTube search
+        downloads       : {video_id: {'status': 'valid'|'invalid', 'file'}}
+        segments        : {audio file: {'status': 'valid'|'invalid', 'file',
+                           'start_ms', 'end_ms', 'gain'}}
+        outputs         : merged mashup files, one per output format
+    """
+
+    FILENAME = 'checkpoint.json'
+
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.path = os.path.join(working_dir, self.FILENAME)
+        self.data = self._load()
+
+        # What this run took from the checkpoint instead of redoing (shown in job status)
+        self.reused = {
+            'search_results': False,
+            'downloads': 0,
+            'segments': 0,
+            'output': False
+        }
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """Write the checkpoint atomically"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def bind(self, **params):
+        """Use the checkpoint for a job with these parameters, discarding it if they differ"""
+        if self.data.get('params') != params:
+            self.data = {'params': params, 'downloads': {}, 'segments': {}}
+            self.save()
+
+    def relative(self, path):
+        return os.path.relpath(path, self.working_dir)
+
+    def absolute(self, path):
+        return os.path.normpath(os.path.join(self.working_dir, path))
+
+    def has_file(self, record):
+        """True if a checkpoint record points at a file that still exists"""
+        return bool(record.get('file')) and os.path.exists(self.absolute(record['file']))
+
+    def search_results(self):
+        return self.data.get('search_results')
+
+    def set_search_results(self, entries):
+        self.data['search_results'] = entries
+        self.save()
+
+    def download(self, video_id):
+        return self.data['downloads'].get(video_id)
+
+    def set_download(self, video_id, status, path=None):
+        self.data['downloads'][video_id] = {
+            'status': status,
+            'file': self.relative(path) if path else None
+        }
+        self.save()
+
+    def segment(self, audio_path):
+        return self.data['segments'].get(self.relative(audio_path))
+
+    def set_segment(self, audio_path, status, path=None, start_ms=None, end_ms=None, gain=None):
+        self.data['segments'][self.relative(audio_path)] = {
+            'status': status,
+            'file': self.relative(path) if path else None,
+            'start_ms': start_ms,
+            'end_ms': end_ms,
+            'gain': gain
+        }
+        self.save()
+
+    def outputs(self):
+        """Merged output files, or None unless all of them still exist"""
+        outputs = [self.absolute(path) for path in self.data.get('outputs') or []]
+        if outputs and all(os.path.exists(path) for path in outputs):
+            return outputs
+        return None
+
+    def set_outputs(self, paths):
+        self.data['outputs'] = [self.relative(path) for path in paths]
+        self.save()
@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Subprocess methods that block while an external tool (ffmpeg, ffprobe, ...) runs
+SUBPROCESS_WAIT_FUNCTIONS = {'communicate', '_communicate', 'wait', '_wait', '_try_wait'}
+
+
+class JobProfiler:
+    """Sampling profiler for a single mashup job
+
+    Samples the stack of the thread that enters it, writes the samples as
+    collapsed stacks (one "frame;frame;frame count" line per stack, the input
+    format of flamegraph.pl and speedscope) and separates time spent waiting on
+    subprocesses from Python CPU time.
+
+    Usage:
+        with JobProfiler(output_path) as profiler:
+            processor.create_mashup(...)
+        profiler.summary
+    """
+
+    def __init__(self, output_path, interval=0.005):
+        self.output_path = output_path
+        self.interval = interval
+        self.stacks = Counter()
+        self.subprocess_wait = Counter()
+        self.samples = 0
+        self.summary = None
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        self._sampler = threading.Thread(target=self._sample_loop, daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        cpu_seconds = time.thread_time() - self._cpu_start
+        wall_seconds = time.perf_counter() - self._wall_start
+        self._stop.set()
+        self._sampler.join()
+
+        subprocess_seconds = sum(self.subprocess_wait.values())
+        self.summary = {
+            'profile_file': self.output_path,
+            'samples': self.samples,
+            'wall_seconds': round(wall_seconds, 3),
+            'python_cpu_seconds': round(cpu_seconds, 3),
+            'subprocess_wait_seconds': round(subprocess_seconds, 3),
+            'subprocess_wait_by_command': {
+                name: round(seconds, 3) for name, seconds in self.subprocess_wait.most_common()
+            },
+            # Network and disk I/O done in-process (e.g. yt-dlp downloads)
+            'other_wait_seconds': round(max(0.0, wall_seconds - cpu_seconds - subprocess_seconds), 3)
+        }
+
+        # A profiling artifact must never fail the job it measures
+        try:
+            self.write_collapsed()
+        except OSError as e:
+            print(f"Could not write profile {self.output_path}: {e}")
+            self.summary['profile_file'] = None
+            self.summary['profile_error'] = str(e)
+        return False
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+
+            stack, command = self._walk(frame)
+            if command:
+                self.subprocess_wait[command] += elapsed
+                stack.append(f"[subprocess:{command}]")
+
+            self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+
+    def _walk(self, frame):
+        """Return the stack (outermost first) and the subprocess being waited on, if any"""
+        stack = []
+        command = None
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+
+            if command is None and code.co_name in SUBPROCESS_WAIT_FUNCTIONS \
+                    and os.path.basename(code.co_filename) == 'subprocess.py':
+                command = self._command_name(frame.f_locals.get('self'))
+
+            frame = frame.f_back
+
+        stack.reverse()
+        return stack, command
+
+    @staticmethod
+    def _command_name(popen):
+        """Executable name of a Popen object (e.g. 'ffmpeg')"""
+        args = getattr(popen, 'args', None)
+        if not args:
+            return 'subprocess'
+        if isinstance(args, (list, tuple)):
+            args = args[0]
+        else:
+            args = str(args).split()[0]
+        return os.path.basename(os.fsdecode(args))
+
+    def write_collapsed(self):
+        """Write samples in collapsed-stack format"""
+        directory = os.path.dirname(self.output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.output_path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
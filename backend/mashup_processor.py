@@ -1,7 +1,6 @@
 import os
 import subprocess
 from pydub import AudioSegment
-from pydub.effects import normalize
 import librosa
 import numpy as np
 from yt_dlp import YoutubeDL
@@ -16,6 +15,28 @@ os.environ['REQUESTS_CA_BUNDLE'] = certifi.where()
 import tempfile
 import shutil
 
+from job_checkpoint import JobCheckpoint
+
+# Loudness targets for per-segment gain (RMS dBFS and peak ceiling)
+TARGET_LOUDNESS_DBFS = -14.0
+PEAK_CEILING_DBFS = -1.0
+
+# Output presets for the export stage: container, file naming and encoder arguments
+OUTPUT_FORMATS = {
+    'mp3': {'container': 'mp3', 'ext': '.mp3', 'suffix': '',
+            'codec': ['-c:a', 'libmp3lame', '-b:a', '192k']},
+    'mp3-mobile': {'container': 'mp3', 'ext': '.mp3', 'suffix': '_mobile',
+                   'codec': ['-c:a', 'libmp3lame', '-b:a', '96k']},
+    'opus': {'container': 'opus', 'ext': '.opus', 'suffix': '',
+             'codec': ['-c:a', 'libopus', '-b:a', '128k', '-ar', '48000']},
+    'aac': {'container': 'mp4', 'ext': '.m4a', 'suffix': '',
+            'codec': ['-c:a', 'aac', '-b:a', '192k']},
+}
+DEFAULT_OUTPUT_FORMATS = ['mp3']
+
+# ffmpeg raw PCM sample formats by pydub sample width (bytes); pydub keeps 8-bit signed
+PCM_FORMATS = {1: 's8', 2: 's16le', 4: 's32le'}
+
 
 class MashupProcessor:
     def __init__(self, working_dir):
@@ -27,6 +48,9 @@ class MashupProcessor:
         os.makedirs(self.downloads_dir, exist_ok=True)
         os.makedirs(self.audio_dir, exist_ok=True)
         os.makedirs(self.segments_dir, exist_ok=True)
+        
+        # Completed work units, so a retried job resumes instead of starting over
+        self.checkpoint = JobCheckpoint(working_dir)
     
     def is_valid_audio(self, audio_path):
         """Check if audio file is valid and not silent"""
@@ -87,17 +111,29 @@ class MashupProcessor:
                 if progress_callback:
                     progress_callback(f"⬇️ Searching and downloading {num_videos} videos...")
                 
-                # Try to get more results to account for failures
-                search_results = ydl.extract_info(f"ytsearch{num_videos + 10}:{search_query}", download=False)
-                
-                if not search_results or 'entries' not in search_results:
-                    raise Exception("No search results found")
+                entries = self.checkpoint.search_results()
+                if entries is not None:
+                    self.checkpoint.reused['search_results'] = True
+                    if progress_callback:
+                        progress_callback(f"♻️ Reusing {len(entries)} saved search results")
+                else:
+                    # Try to get more results to account for failures
+                    search_results = ydl.extract_info(f"ytsearch{num_videos + 10}:{search_query}", download=False)
+                    
+                    if not search_results or 'entries' not in search_results:
+                        raise Exception("No search results found")
+                    
+                    entries = [
+                        {'id': entry.get('id', ''), 'webpage_url': entry['webpage_url']} if entry else None
+                        for entry in search_results['entries']
+                    ]
+                    self.checkpoint.set_search_results(entries)
                 
                 # Download and validate each video
                 downloaded = 0
                 attempts = 0
                 
-                for entry in search_results['entries']:
+                for entry in entries:
                     if downloaded >= num_videos:
                         break
                     
@@ -105,6 +141,19 @@ class MashupProcessor:
                         continue
                     
                     attempts += 1
+                    video_id = entry.get('id', '')
+                    
+                    # Reuse the outcome of an earlier attempt on this video
+                    saved = self.checkpoint.download(video_id)
+                    if saved and saved['status'] == 'invalid':
+                        continue
+                    if saved and self.checkpoint.has_file(saved):
+                        valid_files.append(self.checkpoint.absolute(saved['file']))
+                        downloaded += 1
+                        self.checkpoint.reused['downloads'] += 1
+                        if progress_callback:
+                            progress_callback(f"♻️ Reusing valid audio {downloaded}/{num_videos}")
+                        continue
                     
                     try:
                         if progress_callback:
@@ -114,7 +163,6 @@ class MashupProcessor:
                         ydl.download([entry['webpage_url']])
                         
                         # Find the downloaded file
-                        video_id = entry.get('id', '')
                         potential_file = os.path.join(self.downloads_dir, f"{video_id}.mp3")
                         
                         # Wait a bit for file to be written
@@ -125,9 +173,11 @@ class MashupProcessor:
                         if os.path.exists(potential_file) and self.is_valid_audio(potential_file):
                             valid_files.append(potential_file)
                             downloaded += 1
+                            self.checkpoint.set_download(video_id, 'valid', potential_file)
                             if progress_callback:
                                 progress_callback(f"✅ Valid audio {downloaded}/{num_videos}")
                         else:
+                            self.checkpoint.set_download(video_id, 'invalid')
                             if progress_callback:
                                 progress_callback(f"⚠️ Skipping invalid audio")
                             
@@ -146,11 +196,36 @@ class MashupProcessor:
         except Exception as e:
             raise Exception(f"Download failed: {str(e)}")
     
+    def loudness_gain(self, samples):
+        """Gain in dB that brings samples to the target RMS loudness without clipping"""
+        if samples.size == 0:
+            return 0.0
+        
+        # RMS loudness and peak in dBFS (samples are float in [-1, 1])
+        rms = np.sqrt(np.mean(np.square(samples, dtype=np.float64)))
+        peak = np.max(np.abs(samples))
+        if rms <= 0 or peak <= 0:
+            return 0.0
+        
+        rms_dbfs = 20 * np.log10(rms)
+        peak_dbfs = 20 * np.log10(peak)
+        
+        # Never push the peak above the ceiling
+        gain = min(TARGET_LOUDNESS_DBFS - rms_dbfs, PEAK_CEILING_DBFS - peak_dbfs)
+        return float(gain)
+    
     def detect_chorus(self, audio_path, duration_seconds):
-        """Intelligent chorus detection with better fallback"""
+        """Intelligent chorus detection with better fallback
+        
+        Returns (start_ms, gain_db), where gain_db is the loudness gain for the
+        selected window (None when it could not be measured).
+        """
         try:
             # Load audio
-            y, sr = librosa.load(audio_path, sr=22050, duration=180)  # Only load first 3 minutes
+            # Only load first 3 minutes; keep the channels so loudness is measured
+            # on the same basis as segment_gain (all channels, not a mono downmix)
+            y_channels, sr = librosa.load(audio_path, sr=22050, duration=180, mono=False)
+            y = librosa.to_mono(y_channels)
             
             # Calculate spectral features for energy
             spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
@@ -165,17 +240,12 @@ class MashupProcessor:
             frame_duration = hop_length / sr
             target_frames = int(duration_seconds / frame_duration)
             
-            # Sliding window to find most energetic segment
-            max_energy = 0
+            # Sliding window mean via cumulative sum to find most energetic segment
             best_start_frame = 0
-            
-            window_size = min(len(combined_energy) - target_frames, len(combined_energy))
-            
-            for i in range(window_size):
-                segment_energy = np.mean(combined_energy[i:i+target_frames])
-                if segment_energy > max_energy:
-                    max_energy = segment_energy
-                    best_start_frame = i
+            if 0 < target_frames < len(combined_energy):
+                cumulative = np.concatenate(([0.0], np.cumsum(combined_energy)))
+                window_energy = cumulative[target_frames:] - cumulative[:-target_frames]
+                best_start_frame = int(np.argmax(window_energy[:-1]))
             
             # Convert frame to time
             start_time = best_start_frame * frame_duration
@@ -189,7 +259,12 @@ class MashupProcessor:
             if start_time < 20:
                 start_time = 20
             
-            return start_time * 1000  # Convert to milliseconds
+            # Loudness of the selected window, measured on the samples already in memory
+            start_sample = int(start_time * sr)
+            window = y_channels[..., start_sample:start_sample + int(duration_seconds * sr)]
+            gain = self.loudness_gain(window) if window.size else None
+            
+            return start_time * 1000, gain  # Convert to milliseconds
             
         except Exception as e:
             print(f"Chorus detection failed, using smart fallback: {e}")
@@ -210,12 +285,21 @@ class MashupProcessor:
                 if start_time < 20000:
                     start_time = 20000
                 
-                return start_time
+                return start_time, None
             except:
-                return 20000  # Default to 20 seconds if all fails
+                return 20000, None  # Default to 20 seconds if all fails
+    
+    def segment_gain(self, segment):
+        """Loudness gain for a pydub segment when no analysis pass is available"""
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+        return self.loudness_gain(samples / float(1 << (8 * segment.sample_width - 1)))
     
     def extract_segment(self, audio_path, duration_seconds, use_intelligent=True):
-        """Extract audio segment with validation"""
+        """Extract audio segment with validation
+        
+        Returns (segment, gain_db, start_ms, end_ms) or None. The gain is applied
+        later, during merge.
+        """
         try:
             audio = AudioSegment.from_mp3(audio_path)
             duration_ms = duration_seconds * 1000
@@ -225,9 +309,10 @@ class MashupProcessor:
                 print(f"Audio too short: {len(audio)}ms")
                 return None
             
+            gain = None
             if use_intelligent:
-                # Use intelligent chorus detection
-                start_time = self.detect_chorus(audio_path, duration_seconds)
+                # Use intelligent chorus detection (also measures loudness)
+                start_time, gain = self.detect_chorus(audio_path, duration_seconds)
             else:
                 # Skip intro, take from 20-30s mark
                 start_time = 20000
@@ -239,6 +324,7 @@ class MashupProcessor:
             if end_time > len(audio):
                 start_time = max(20000, len(audio) - duration_ms - 5000)
                 end_time = start_time + duration_ms
+                gain = None  # Window moved, analysis no longer matches
             
             segment = audio[start_time:end_time]
             
@@ -247,55 +333,124 @@ class MashupProcessor:
                 print(f"Segment too quiet, skipping")
                 return None
             
-            # Normalize volume
-            segment = normalize(segment)
+            if gain is None:
+                gain = self.segment_gain(segment)
+            
+            # Cap against the true per-channel peak at full rate; apply_gain hard-clips
+            gain = min(gain, PEAK_CEILING_DBFS - segment.max_dBFS)
             
             # Add crossfade-friendly fades (longer for smoother transitions)
             segment = segment.fade_in(1000).fade_out(1000)
             
-            return segment
+            return segment, gain, start_time, end_time
             
         except Exception as e:
             print(f"Error extracting segment from {audio_path}: {e}")
             return None
     
-    def merge_audio_segments(self, segments, output_path, progress_callback=None):
-        """Merge audio segments with crossfade for smooth transitions"""
+    def output_paths(self, output_path, output_formats=None):
+        """Output file of each requested format, named after output_path"""
+        base = os.path.splitext(output_path)[0]
+        return [
+            (f"{base}{OUTPUT_FORMATS[name]['suffix']}{OUTPUT_FORMATS[name]['ext']}", name)
+            for name in (output_formats or DEFAULT_OUTPUT_FORMATS)
+        ]
+    
+    def encode_outputs(self, audio, outputs):
+        """Encode audio to every (path, format) in outputs with a single ffmpeg run
+        
+        The PCM is streamed to ffmpeg once and fanned out to one output per
+        format, instead of decoding and exporting separately for each one.
+        """
+        # Other widths (e.g. 24-bit) have no matching raw format here, convert to 16-bit
+        if audio.sample_width not in PCM_FORMATS:
+            audio = audio.set_sample_width(2)
+        
+        command = [
+            AudioSegment.converter, '-y', '-loglevel', 'error',
+            '-f', PCM_FORMATS[audio.sample_width],
+            '-ar', str(audio.frame_rate),
+            '-ac', str(audio.channels),
+            '-i', 'pipe:0'
+        ]
+        for path, name in outputs:
+            preset = OUTPUT_FORMATS[name]
+            command += preset['codec'] + ['-f', preset['container'], path]
+        
+        process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _, stderr = process.communicate(input=audio.raw_data)
+        
+        if process.returncode != 0:
+            raise Exception(f"Encoding failed: {stderr.decode(errors='replace').strip()[-500:]}")
+        
+        return [path for path, _ in outputs]
+    
+    def merge_audio_segments(self, segments, output_path, progress_callback=None, gains=None,
+                             output_formats=None):
+        """Merge audio segments with crossfade for smooth transitions
+        
+        gains holds the per-segment loudness gain in dB from the analysis pass;
+        each one is applied to its segment as it is merged. The mashup is
+        encoded once to each of output_formats (keys of OUTPUT_FORMATS) and the
+        list of written files is returned, in the order requested.
+        """
         if progress_callback:
             progress_callback(f"🎼 Merging {len(segments)} segments with crossfade...")
         
         if len(segments) == 0:
             raise Exception("No segments to merge")
         
+        if gains is None:
+            gains = [0.0] * len(segments)
+        
         # Start with first segment
-        mashup = segments[0]
+        mashup = segments[0].apply_gain(gains[0])
         
         # Add remaining segments with crossfade
-        for i, segment in enumerate(segments[1:], 1):
+        for i, (segment, gain) in enumerate(zip(segments[1:], gains[1:]), 1):
             if progress_callback and i % 3 == 0:
                 progress_callback(f"🎼 Merging... {i}/{len(segments)-1}")
             
             # Crossfade between segments (500ms overlap)
-            mashup = mashup.append(segment, crossfade=500)
-        
-        # Final normalization
-        mashup = normalize(mashup)
+            mashup = mashup.append(segment.apply_gain(gain), crossfade=500)
         
-        # Export with high quality
+        # Export all formats in one pass
+        outputs = self.output_paths(output_path, output_formats)
         if progress_callback:
-            progress_callback("💾 Saving final mashup...")
+            progress_callback(f"💾 Saving final mashup ({', '.join(name for _, name in outputs)})...")
         
-        mashup.export(output_path, format='mp3', bitrate='192k', parameters=["-q:a", "0"])
+        paths = self.encode_outputs(mashup, outputs)
         
         if progress_callback:
-            progress_callback(f"✅ Mashup created: {os.path.basename(output_path)}")
+            progress_callback(f"✅ Mashup created: {', '.join(os.path.basename(path) for path in paths)}")
         
-        return output_path
+        return paths
     
     def create_mashup(self, singer_name, num_videos, duration, output_filename, 
-                     progress_callback=None, use_intelligent_extraction=True):
-        """Main function to create mashup with quality validation"""
+                     progress_callback=None, use_intelligent_extraction=True, output_formats=None):
+        """Main function to create mashup with quality validation
+        
+        Returns the list of output files, one per requested format.
+        """
         try:
+            self.checkpoint.bind(
+                singer_name=singer_name,
+                num_videos=num_videos,
+                duration=duration,
+                output_filename=output_filename,
+                use_intelligent_extraction=use_intelligent_extraction
+            )
+            
+            # Merged output from an earlier run, if it has every requested format
+            output_path = os.path.join(self.working_dir, output_filename)
+            expected = [os.path.normpath(path) for path, _ in self.output_paths(output_path, output_formats)]
+            if self.checkpoint.outputs() == expected:
+                self.checkpoint.reused['output'] = True
+                if progress_callback:
+                    progress_callback(f"♻️ Reusing merged mashup: {', '.join(os.path.basename(path) for path in expected)}")
+                return expected
+            
             # Step 1: Download videos
             audio_files = self.download_videos(singer_name, num_videos, progress_callback)
             
@@ -307,14 +462,34 @@ class MashupProcessor:
                 progress_callback(f"🎵 Extracting {'intelligent' if use_intelligent_extraction else 'standard'} segments...")
             
             segments = []
+            gains = []
             for i, audio_file in enumerate(audio_files, 1):
                 if progress_callback:
                     progress_callback(f"🎵 Processing audio {i}/{len(audio_files)}...")
                 
+                saved = self.checkpoint.segment(audio_file)
+                if saved and saved['status'] == 'invalid':
+                    continue
+                if saved and self.checkpoint.has_file(saved):
+                    segments.append(AudioSegment.from_wav(self.checkpoint.absolute(saved['file'])))
+                    gains.append(saved['gain'])
+                    self.checkpoint.reused['segments'] += 1
+                    if progress_callback:
+                        progress_callback(f"♻️ Reusing segment {len(segments)}")
+                    continue
+                
                 try:
-                    segment = self.extract_segment(audio_file, duration, use_intelligent_extraction)
-                    if segment is not None:  # Only add valid segments
+                    extracted = self.extract_segment(audio_file, duration, use_intelligent_extraction)
+                    if extracted is None:
+                        self.checkpoint.set_segment(audio_file, 'invalid')
+                    else:  # Only add valid segments
+                        segment, gain, start_ms, end_ms = extracted
+                        segment_path = os.path.join(
+                            self.segments_dir, f"{os.path.splitext(os.path.basename(audio_file))[0]}.wav")
+                        segment.export(segment_path, format='wav')
+                        self.checkpoint.set_segment(audio_file, 'valid', segment_path, start_ms, end_ms, gain)
                         segments.append(segment)
+                        gains.append(gain)
                         if progress_callback:
                             progress_callback(f"✅ Valid segment {len(segments)}")
                 except Exception as e:
@@ -328,10 +503,11 @@ class MashupProcessor:
                 progress_callback(f"✅ Extracted {len(segments)} high-quality segments")
             
             # Step 3: Merge segments
-            output_path = os.path.join(self.working_dir, output_filename)
-            self.merge_audio_segments(segments, output_path, progress_callback)
+            output_paths = self.merge_audio_segments(segments, output_path, progress_callback, gains,
+                                                     output_formats)
+            self.checkpoint.set_outputs(output_paths)
             
-            return output_path
+            return output_paths
             
         except Exception as e:
             raise Exception(f"Mashup creation failed: {str(e)}")
\ No newline at end of file